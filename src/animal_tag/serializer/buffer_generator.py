@@ -1,9 +1,56 @@
 import struct
 import argparse
 import json
+from functools import lru_cache
+
+from animal_tag.serializer.utils import get_packet_size, get_packet_dtype
+from numpy import linspace, zeros
+
+@lru_cache(maxsize=None)
+def packet_template(data_format : str, num_reps : int, value : int, time_step : int):
+    """Creates the packets of a buffer with every channel but time filled in
+
+    These are the same for every buffer written with the same specifications, so they are only made once.
+
+    Args:
+        data_format (str): The format of the data in the MTAG format
+        num_reps (int): The number of data packets in the buffer
+        value (int): The value to write to each data channel
+        time_step (int): The time in between buffer writes
+
+    Returns:
+        tuple(np.ndarray, np.ndarray): The (read-only) packets, and how long before the buffer time each packet was taken
+    """
+    packets = zeros(num_reps, dtype=get_packet_dtype(data_format))
+    for name in packets.dtype.names:
+        if name == "T":
+            continue
+        if packets.dtype[name].kind == "V":  # 24-bit values are kept as their raw bytes
+            packets[name] = (value % 2**24).to_bytes(3, "little")
+        else:
+            packets[name] = value
+    packets.flags.writeable = False
+    # packet times are evenly spread over the time since the last buffer
+    time_offsets = linspace(start=time_step, stop=0, num=(num_reps+1))[1:]
+    time_offsets.flags.writeable = False
+    return packets, time_offsets
+
+
+@lru_cache(maxsize=None)
+def header_packer(header_format : str):
+    """Compiles the struct that packs a buffer header, and finds where the ID and time go in it
+
+    Every buffer of a device has a header of the same format, so this is only done once per format.
+
+    Args:
+        header_format (str): The buffer header format in the MTAG format
+
+    Returns:
+        tuple(struct.Struct, int, int): The compiled header struct, and the index of the ID and of the time field
+    """
+    header_struct = struct.Struct("<" + DataBuffer._correct_format(header_format))
+    return header_struct, header_format.find("B"), header_format.find("T")
 
-from animal_tag.serializer.utils import get_packet_size
-from numpy import linspace
 
 class DataBuffer:
     def __init__(self, output_file : str, id : int, time : int, header_format : str,
@@ -77,20 +124,19 @@ class DataBuffer:
         header_size = get_packet_size(header_format)
         data_packet_size = get_packet_size(data_format)
         num_reps = (buffer_size - header_size)//data_packet_size  # shorthand division operator to cast to int: a//b is equivalent to floor(a/b) or int(a/b)    
-        bytes_underflow = buffer_size - header_size - num_reps*data_packet_size
 
-        buffer = self.create_buffer_header(header_format, id, time)
+        # The buffer starts zeroed, so the null bytes underflowing the last packet need no writing
+        buffer = bytearray(buffer_size)
+        buffer[:header_size] = self.create_buffer_header(header_format, id, time)
 
-        for i in range(num_reps):
-            temp_data = [value if char != 'x' else 0 for char in data_format]
-            t_offset  = linspace(start=self.time, stop=0, num=(num_reps+1))[1:]
-            if data_format.find('T') != -1:  # this function gives -1 on failure, which if it does we can ignore the case
-                temp_data[data_format.find('T')] = int(time - t_offset[i])
-            buffer += struct.pack("<"+self._correct_format(data_format), *temp_data)  # we need to go from the MTAG format to the struct/rawutils format
-            # we need to pass as seperate arguments each element of temp_data, thus the use of the * operator
-        buffer += struct.pack("<"+bytes_underflow*"B", *([0 for _ in range(bytes_underflow)]))  # similar as above, keeps the code concise here
+        # Every packet holds the same values apart from its time, so only the time changes from buffer to buffer
+        template, time_offsets = packet_template(data_format, num_reps, value, self.time)
+        packets = template.copy()
+        if "T" in packets.dtype.names:
+            packets["T"] = time - time_offsets
+        buffer[header_size:(header_size + num_reps*data_packet_size)] = packets.tobytes()
 
-        return buffer
+        return bytes(buffer)
 
 
     def create_buffer_header(self, header_format : str, id : int, time: int):
@@ -104,29 +150,31 @@ class DataBuffer:
         Returns:
             _type_: _description_
         """
-        data_pack = [0 for _ in header_format]
-        data_pack[header_format.find("B")] = id
-        data_pack[header_format.find("T")] = time
-        return struct.pack("<" + self._correct_format(header_format), *data_pack)
+        header_struct, id_index, time_index = header_packer(header_format)
+        data_pack = [0]*len(header_format)
+        data_pack[id_index] = id
+        data_pack[time_index] = time
+        return header_struct.pack(*data_pack)
 
     def write_file(self):
         """Write an MTAG file that satisfies the class inputs
-        """            
+        """
+        header = json.dumps(self.create_file_header(), ensure_ascii=False).encode('utf-8')  # binary file, so we have to encode the string
+        header += '\n'.encode('utf-8')  # this is a binary file, we need to encode the string, a header is terminated by a new line
+
+        # The whole file is put together in memory first, and then written with a single write
+        parts = [header]
+        for i in range(self.num_buffers):
+            parts.append(self.create_buffer(id=self.id, time=(i+1)*self.time, header_format=self.header_format,
+                                            data_format=self.data_format, buffer_size=self.buffer_size,
+                                            value=self.value))
+        self.data = b''.join(parts)
+
         with open(self.output_file, 'wb') as f:
-            header = json.dumps(self.create_file_header(), ensure_ascii=False).encode('utf-8')  # binary file, so we have to encode the string
-            header += '\n'.encode('utf-8')  # this is a binary file, we need to encode the string, a header is terminated by a new line
-
-            self.data += header
-            f.write(header)
-
-            for i in range(self.num_buffers):
-                buffer = self.create_buffer(id=self.id, time=(i+1)*self.time, header_format=self.header_format,
-                                           data_format=self.data_format, buffer_size=self.buffer_size,
-                                           value=self.value)
-                self.data += buffer
-                f.write(buffer)
-   
-    def _correct_format(self, format : str):
+            f.write(self.data)
+
+    @staticmethod
+    def _correct_format(format : str):
         """Takes in mtag deserializer format and returns rawutil/struct formatting
 
         Args:
@@ -170,7 +218,7 @@ if __name__ == '__main__':
     parser.add_argument('-N', '--name', type=str, default="Lono", help="Name of the animal")
     parser.add_argument('-S', '--species', type=str, default="Tursiops truncatus", help="Animal species")
     parser.add_argument('-D', '--date', type=str, default="1995/10/26 14:15:00", help="Experiment time")
-    parser.add_argument('-c', '--channel_names', nargs='+', type=str, default='ch1', help="The name of each data channel")
+    parser.add_argument('-c', '--channel_names', nargs='+', type=str, default=['ch1'], help="The name of each data channel")
 
     args = parser.parse_args()
 
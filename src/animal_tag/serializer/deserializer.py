@@ -1,19 +1,43 @@
-import rawutil
-import struct
 from pathlib import Path
 import os
+import mmap
 import tqdm
-from json import JSONDecoder
-from collections import deque
 import h5py
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from animal_tag.serializer.utils import (get_packet_size, correct_format,
-                                         count_data_channels, import_external_header,
-                                         DataBuffer, DataWrite)
+from animal_tag.serializer.utils import (get_packet_size, get_buffer_dtype, get_buffer_unpacker, get_data_dtype,
+                                         get_channel_types, count_data_channels, import_external_header,
+                                         load_header, DataBuffer, DataWrite)
 
 
+# Number of bytes to read in between updates of the loading bar
+LOADING_BAR_STEP = 1 << 20
+# Files at least this size are memory mapped rather than read into memory whole
+MAP_FILE_SIZE = 1 << 24
+# A memory mapped file is decoded this many bytes at a time, and each part let go of once it has been saved
+DECODE_WINDOW_SIZE = 1 << 24
+
+# Target size of an HDF5 chunk, and of the chunk cache of the file being written
+CHUNK_SIZE = 1 << 16
+CHUNK_CACHE_SIZE = 16 << 20
+# Filters applied to every dataset: byte shuffling followed by LZF, which ships with h5py and is fast to write
+COMPRESSION = dict(shuffle=True, compression='lzf')
+
+def chunk_length(num_packets, row_size, num_samples):
+    """Number of samples in an HDF5 chunk, a whole number of buffers close to CHUNK_SIZE bytes
+
+    Args:
+        num_packets (int): Number of samples per buffer
+        row_size (int): Size in bytes of one sample in the dataset
+        num_samples (int): Number of samples in the dataset, which a chunk cannot be longer than
+
+    Returns:
+        int: The chunk length
+    """
+    return min(num_samples, num_packets*max(1, CHUNK_SIZE//(num_packets*row_size)))
+
 class SaveFileLoc():
     def __init__(self, size):
         self.size = size
@@ -29,52 +53,56 @@ class SaveFileLoc():
 class FileSaver():
     def __init__(self, filename: str, decoder: dict = {}):
         if filename:
-            self.file = h5py.File(filename, 'w')
+            self.file = h5py.File(filename, 'w', rdcc_nbytes=CHUNK_CACHE_SIZE)
         else:
             self.file = ""
 
         self.locs = {}
+        self.datasets = {}  # the time and data datasets of each device, kept to write to without looking them up
         if decoder:
             self.create_datasets(decoder)  # sets self.locs internally            
 
     def close_file(self):
-        for key in self.locs:
-            if self.locs[key].ind < self.locs[key].size:
-                self.file[key]['time'].resize(self.locs[key].ind, axis=0)
-                self.file[key]['data'].resize(self.locs[key].ind, axis=0)
         self.file.close()
 
     def save_header(self, header):
         self._save_header(self.file, header)
 
     def save_data(self, ID, to_save : DataWrite):
-        for time, data in to_save.sub_chunks():
-            self.save_data_chunk(ID, time, data, len(time))
+        # A pop is a whole number of buffers and is written with one write per dataset rather than one per
+        # buffer; the chunk cache holds any HDF5 chunk it only partly fills until the next pop completes it
+        if len(to_save.time) % to_save.chunk_size:
+            raise ValueError("Length of time must be a multiple of chunk_size")
+        self.save_data_chunk(ID, to_save.time, to_save.data, len(to_save.time))
             
     def save_data_chunk(self, ID, time, data, chunk_size):
-        time_set = self.file[ID]['time']
-        data_set = self.file[ID]['data']
-        if self.locs[ID].size < self.locs[ID].ind + chunk_size:
-            new_size = 2*time_set.shape[0]
-            time_set.resize(new_size, axis=0)
-            data_set.resize(new_size, axis=0)
-            self.locs[ID].set_size(new_size)
-        self.file[ID]['time'][self.locs[ID].ind:
-                              (self.locs[ID].ind+chunk_size)] = time
-        self.file[ID]['data'][self.locs[ID].ind:
-                              (self.locs[ID].ind+chunk_size), :] = data
+        # The datasets are created at their final size, so the data only has to be written to its place in them
+        time_set, data_set = self.datasets[ID]
+        dest = np.s_[self.locs[ID].ind:(self.locs[ID].ind+chunk_size)]
+        time_set.write_direct(np.ascontiguousarray(time), dest_sel=dest)
+        if isinstance(data_set, list):  # split channels, each channel goes to its own dataset
+            for channel_set, channel_data in zip(data_set, data):
+                channel_set.write_direct(np.ascontiguousarray(channel_data), dest_sel=dest)
+        else:
+            data_set.write_direct(np.ascontiguousarray(data), dest_sel=dest)
         self.locs[ID].add_ind(chunk_size)
 
     def _save_header(self, hf, header_dict):
-        for k, v, in header_dict.items():
-            if isinstance(v, dict):
-                g = hf.create_group(k)
-                self._save_header(g, v)
-            else:
-                if v is None:
+        # Walk the header with a stack rather than recursion. Scalars are stored as attributes of their group,
+        # which is far cheaper than a dataset each; only array-like values become datasets
+        to_save = [(hf, header_dict)]
+        while to_save:
+            group, group_dict = to_save.pop()
+            for k, v, in group_dict.items():
+                if isinstance(v, dict):
+                    to_save.append((group.create_group(k, track_order=False), v))
+                elif v is None:
                     # need to change None to make it saveable by h5py
-                    v = np.nan
-                hf.create_dataset(k, data=v)
+                    group.attrs[k] = np.nan
+                elif np.ndim(v) == 0:
+                    group.attrs[k] = v
+                else:
+                    group.create_dataset(k, data=v)
 
     def create_datasets(self, decoder: dict):
         dataset_dict = dict()
@@ -84,26 +112,41 @@ class FileSaver():
             if num_samples == 0:
                 continue  #skip if we don't actually have this in the buffer system
 
-            # TODO: Assign a specific data type to each channel to save space
+            if len(dicts["channel_names"]) != dicts["num_channels"]:
+                raise ValueError("Device {} has {} channel names, but its data format {} has {} data channels".format(
+                    dicts["device"], len(dicts["channel_names"]), dicts["data"], dicts["num_channels"]))
+
             # TODO: If channel only contains time data, then do not create a 'data' section
             g = self.file.create_group(dicts["device"])
             d1 = g.create_dataset('time', shape=(num_samples, ),
-                                  maxshape=(num_samples, ),
-                                  chunks=(dicts["num_packets"], ),
-                                  dtype='d')
+                                  chunks=(chunk_length(dicts["num_packets"], 8, num_samples), ),
+                                  dtype='d', **COMPRESSION)
             #TODO: Add units
             #d1.attrs['units'] = 'sec'
 
-            num_data_channels = len(dicts["channel_names"])
-
-            d2 = g.create_dataset('data', shape=(num_samples,
-                                                 num_data_channels),
-                                  maxshape=(num_samples, num_data_channels),
-                                  chunks=(dicts["num_packets"], num_data_channels),
-                                  dtype='d')
+            if dicts.get("split_channel", False):
+                # Each channel is its own dataset in a 'data' group, stored in the channel's own type
+                channels = g.create_group('data')
+                d2 = []
+                for channel_name, channel_type in zip(dicts["channel_names"], get_channel_types(dicts["data"])):
+                    itemsize = np.dtype(channel_type).itemsize
+                    d2.append(channels.create_dataset(channel_name, shape=(num_samples, ),
+                                                      chunks=(chunk_length(dicts["num_packets"], itemsize,
+                                                                           num_samples), ),
+                                                      dtype=channel_type, **COMPRESSION))
+            else:
+                num_data_channels = dicts["num_channels"]
+                data_dtype = get_data_dtype(dicts["data"])  # the channels are stored as read, not as doubles
+                row_size = num_data_channels*data_dtype.itemsize
+                d2 = g.create_dataset('data', shape=(num_samples,
+                                                     num_data_channels),
+                                      chunks=(chunk_length(dicts["num_packets"], row_size, num_samples),
+                                              num_data_channels),
+                                      dtype=data_dtype, **COMPRESSION)
             #d2.attrs['units'] = dicts.units
 
             dataset_dict[dicts["device"]] = SaveFileLoc(size=num_samples) #we know what the size is
+            self.datasets[dicts["device"]] = (d1, d2)
         self.locs = dataset_dict
 
 
@@ -112,45 +155,114 @@ class FileReader:
         self.name = filename
         self.size = os.path.getsize(filename)
         self.bytes_read = 0
+        self.bytes_shown = 0  # bytes read that the loading bar has been updated with
         self.file_handle = 0
+        self.mm = None    # the file contents once opened (read in, or memory mapped if large), read through a memoryview
+        self.mv = None
+        self.pos = 0
         self.loading_bar = tqdm.tqdm(initial=0, total=self.size,
                                      unit="B", unit_scale=True,
-                                     unit_divisor=1024, leave=True)
+                                     unit_divisor=1024, leave=True, mininterval=0.2)
         self.data_buffer_start = []
-        self.saved_loc = 0
 
     def update_bytes_read(self, amount):
+        # Updating the loading bar is far slower than a small read, so it is only updated once enough has been read
         self.bytes_read += amount
-        self.loading_bar.update(amount)
+        if self.bytes_read - self.bytes_shown >= LOADING_BAR_STEP:
+            self.refresh_loading_bar()
+
+    def refresh_loading_bar(self):
+        self.loading_bar.update(self.bytes_read - self.bytes_shown)
+        self.bytes_shown = self.bytes_read
 
     def open_file(self):
         self.file_handle = open(self.name, 'rb')
+        if self.size < MAP_FILE_SIZE:  # one read is cheaper than paging a small file in (and an empty one cannot be mapped)
+            self.mm = self.file_handle.read()
+        else:
+            self.mm = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mv = memoryview(self.mm)
+        self.pos = 0
 
     def close_file(self):
+        # Arrays read from the file can still be viewing the map, so rather than closing it here
+        # it is left to close once the last of them is gone
+        self.mv.release()
+        self.mm = None
         self.file_handle.close()
 
     def readline(self):
-        content = self.file_handle.readline()
+        end = self.mm.find(b"\n", self.pos)
+        end = self.size if end == -1 else end + 1
+        content = bytes(self.mv[self.pos:end])
+        self.pos = end
         self.update_bytes_read(len(content))
         self.data_buffer_start = len(content)
         return content
 
     def read(self, num_bytes):
-        self.update_bytes_read(num_bytes)
-        return self.file_handle.read(num_bytes)
-    
-    def save_current_loc(self):
-        self.saved_loc = self.file_handle.tell()
+        """Read from the current file location
+
+        Args:
+            num_bytes (int): Number of bytes to read
+
+        Returns:
+            memoryview: The bytes read, as a view into the file rather than a copy
+        """
+        content = self.mv[self.pos:(self.pos+num_bytes)]
+        self.pos += len(content)
+        self.update_bytes_read(len(content))
+        return content
     
+    def read_records(self, offsets, dtype):
+        """Read records at the given file locations, without moving the current file location
+
+        Args:
+            offsets (np.ndarray): Start of each record, in increasing order
+            dtype (np.dtype): Type of the records
+
+        Returns:
+            np.ndarray: The records. When they lie back to back this is a view into the file, otherwise a copy
+        """
+        num_records = len(offsets)
+        if num_records == 0:
+            return np.empty(0, dtype=dtype)
+        if offsets[-1] - offsets[0] == (num_records - 1)*dtype.itemsize:  # contiguous, so no need to gather
+            records = np.frombuffer(self.mv, dtype=dtype, count=num_records, offset=offsets[0])
+        else:
+            # A view of the file with a record starting at every byte, so that indexing it copies out
+            # whole records, taking no more memory than the records themselves
+            record_starts = np.ndarray(shape=(self.size - dtype.itemsize + 1, ), dtype=dtype,
+                                       buffer=self.mv, strides=(1, ))
+            records = record_starts[offsets]
+        self.update_bytes_read(num_records*dtype.itemsize)
+        return records
+
+    def release(self, start, end):
+        """Let go of the memory holding the file from start to end, as it will not be read again
+
+        Only a memory mapped file is released; its pages are dropped and would be read back in from disk if needed.
+
+        Args:
+            start (int): File location from which the file has been read
+            end (int): File location up to which the file has been read
+        """
+        if not isinstance(self.mm, mmap.mmap) or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start += -start % mmap.PAGESIZE  # madvise works on whole pages, so only the pages fully in the range go
+        end -= end % mmap.PAGESIZE
+        if end > start:
+            self.mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
     def seek(self, offset, whence):
         """Seek a new file location
 
-        See also seek() in Python, that this wraps
+        See also seek() in Python, that this mimics
         Args:
             offset (int): Offset location
             whence (int): File location to start at. 0 is beginning of file, 1 is current file location, and 2 is from end of file.
         """
-        self.file_handle.seek(offset, whence)
+        self.pos = (0, self.pos, self.size)[whence] + offset
     
     def tell(self):
         """Get the current file location
@@ -158,7 +270,7 @@ class FileReader:
         Returns:
             int: Current file location from start of file
         """
-        return self.file_handle.tell()
+        return self.pos
 
 
 class FileParser():
@@ -170,21 +282,23 @@ class FileParser():
         self.saver   : FileSaver       = FileSaver(savefilename)
         self.header  : dict[str, dict] = {}
         self.decoder : dict[int, dict] = {}  # is populated when file header is read
+        self.decoder_by_id : list[dict | None] = [None]*256  # the decoder indexed by ID byte, None for unused IDs
         self.data    : dict[int, DataBuffer] = {}
         self.num_to_pop : int = num_to_pop
         self.buffer_pop_boundry : int = buffer_pop_boundry
         self.tot_buffers = 0
 
-    def process_buffer(self, ID, header_data, header_time, data, time):
-        if self.data[ID]["data"].append_raw_data(header_data, header_time, data, time):
-            num_popped = min(self.num_to_pop, self.data[ID]["num_buffs"])
-            reconstructed_data = self.data[ID]["data"].pop_data(num_popped,
-                                                                self.decoder[ID]["num_packets"],
-                                                                self.decoder[ID]["num_channels"])
-            self.data[ID]["num_buffs"] -= num_popped
-            return reconstructed_data
-        else:
-            return None
+    def save_popped(self, ID, num_to_pop):
+        """Pop buffers off the DataBuffer of a device, and save them
+
+        Args:
+            ID (int): ID of the device
+            num_to_pop (int): Number of buffers to pop
+        """
+        reconstructed_data = self.data[ID].pop_data(num_to_pop,
+                                                    self.decoder[ID]["num_packets"],
+                                                    self.decoder[ID]["num_channels"])
+        self.saver.save_data(self.decoder[ID]["device"], reconstructed_data)
 
     def initialize_data(self):
         """Initialize the data buffer based on the decoder for each device
@@ -199,15 +313,19 @@ class FileParser():
         of the number of buffers that were added
         """
         for key, value in self.decoder.items():
-            empty_buffer = DataBuffer(data=[deque() for char in value["data"] if char.lower() != "x" and char.lower() != "t"],
-                                      pop_boundry=self.buffer_pop_boundry,
-                                      chunk_size=value["num_packets"])
+            # The buffer never holds more than pop_boundry buffers before being popped, so with the buffers
+            # counted it can be given all the room it will ever need up front
+            max_buffers = max(1, min(value["num_buffers"], self.buffer_pop_boundry))
+            empty_buffer = DataBuffer(pop_boundry=self.buffer_pop_boundry,
+                                      chunk_size=value["num_packets"],
+                                      channel_types=get_channel_types(value["data"]),
+                                      has_time=value["data_has_time"],
+                                      initial_capacity=max_buffers*value["num_packets"],
+                                      split_channels=value.get("split_channel", False))
             empty_buffer.reset()  # forcefully clear any data, suspect some scoping error within pytest perhaps
                                   # or how the variables are created, occassionally these would contain data
                                   # With these lines incorporated, tests do not really have an issue of passing
-            self.data.update({key: {"data": empty_buffer,
-                                    "num_buffs": 0}
-                             })
+            self.data.update({key: empty_buffer})
 
     def open_file(self):
         self.file.open_file()
@@ -220,73 +338,98 @@ class FileParser():
             self.header = self.read_file_header() 
         self.generate_decoder()
         self.count_buffers()
+        self.file.release(0, self.file.size)  # counting went over the whole file, which is now paged back in as decoded
         self.saver.create_datasets(self.decoder)
         self.initialize_data()
-        buffers_read = 0
-        while buffers_read < self.tot_buffers:
-            id, header_data, header_time, data, time = self.read_data_buffer()
-            reconstructed_data = self.process_buffer(id, header_data, header_time, data, time)
-            buffers_read += 1
-            if reconstructed_data is not None:
-                self.saver.save_data(self.decoder[id]["device"], reconstructed_data)
+        # Rather than going through the file one buffer at a time, the buffers of a device are decoded in batches
+        # of up to its pop boundry, then passed on to its DataBuffer. The next batch is decoded in the background
+        # while the current one is saved (numpy and h5py let go of the GIL for the heavy lifting), so at most two
+        # batches are held in memory at once, however large the file is
+        batches = self.decode_batches()
+        released_to = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            next_decoded = pool.submit(self.decode_buffers, *batches[0][:3]) if batches else None
+            for i, (id, _, _, release_to) in enumerate(batches):
+                decoded = next_decoded.result()
+                if i + 1 < len(batches):
+                    next_decoded = pool.submit(self.decode_buffers, *batches[i + 1][:3])
+                self.save_device(id, *decoded)
+                del decoded  # let go of this batch before the one after next is decoded
+                if release_to:
+                    self.file.release(released_to, release_to)
+                    released_to = release_to
 
         # All file data read, consume whatever data remains unread
-        for id in self.data.keys():
-            if self.data[id]["num_buffs"] > 0:  #ensure there actually is data to pop here, otherwise error would be thrown
-                reconstructed_data = self.data[id]["data"].pop_data(self.data[id]["num_buffs"],
-                                                                    self.decoder[id]["num_packets"],
-                                                                    self.decoder[id]["num_channels"])
-                self.saver.save_data(self.decoder[id]["device"], reconstructed_data)
+        for id, data_buffer in self.data.items():
+            if data_buffer.num_buffers > 0:  #ensure there actually is data to pop here, otherwise error would be thrown
+                self.save_popped(id, data_buffer.num_buffers)
 
         self.file.close_file()
         self.saver.close_file()
-        self.file.update_bytes_read(0)
-
-    def read_data_header(self, ID):
-        header_content = self.file.read(get_packet_size(self.decoder[ID]["header"])-1)
-        data = struct.unpack(correct_format(self.decoder[ID]["header"][1:]), header_content)
-        if self.decoder[ID]["header_has_time"]:
-            t_index = self.decoder[ID]["header"][1:].index("T")
-            time = data[t_index]
-            data = data[:t_index] + data[t_index+1:]
-        else:
-            time = []
-            data = data
-
-        return data, time
-
-    def read_raw_data_buffer(self, ID):
-        # Read the data from the buffer in
-        all_bytes = self.file.read(self.decoder[ID]["buffer_size"] - self.decoder[ID]["header_size"])
-        if "u" in self.decoder[ID]["data"].lower():  # for handling 24-bit numbers, we need rawutil
-            raw_data = rawutil.unpack(correct_format(self.decoder[ID]["data_read_format"]), all_bytes)
-        else:  # struct is faster for all other types
-            raw_data = struct.unpack(correct_format(self.decoder[ID]["data_read_format"]), all_bytes)
-        # Now based on the data, seperate out the channels and use the smallest numpy type to fit it in
-        #TODO: allow for null bytes to be handled elegantly here (right now we can only handle data types that do not contain null bytes in sampling)
-        data = [raw_data[i::len(self.decoder[ID]["data"])] for i, channel in enumerate(self.decoder[ID]["data"])]  #index the list
-        
-        if self.decoder[ID]["data_has_time"]:
-            t_index = self.decoder[ID]["data"].index("T")
-            time = data[t_index]
-            data = data[:t_index] + data[(t_index+1):]
-        else:
-            time = []
-            data = data
-        
-        return data, time
-
-    def read_data_buffer(self):
-        id = self.read_id()
-        [header_data, header_time] = self.read_data_header(id)
-        [data, time] = self.read_raw_data_buffer(id)
-        self.data[id]["num_buffs"] += 1  #increment num_buffs
-        return (id, header_data, header_time, data, time)
+        self.file.refresh_loading_bar()
+
+    def decode_batches(self):
+        """Split the buffers of the file into the batches they are decoded in
+
+        The file is gone through in windows of DECODE_WINDOW_SIZE bytes. Within each, the buffers of every device
+        are split into batches of up to the pop boundry. A device's batches stay in file order, so its data is
+        saved just as if its buffers were decoded one by one.
+
+        Returns:
+            list[tuple(int, int, int, int)]: The ID of the device, the index of its first buffer in the batch and the
+                                             index after its last, and, on the last batch of a window, the end of the
+                                             window (0 otherwise)
+        """
+        batches = []
+        for window_start in range(0, self.file.size, DECODE_WINDOW_SIZE):
+            window_end = min(window_start + DECODE_WINDOW_SIZE, self.file.size)
+            for id, value in self.decoder.items():
+                offsets = value["buffer_offsets"]
+                first, last = np.searchsorted(offsets, (window_start, window_end))
+                batches.extend((id, int(start), int(min(start + self.buffer_pop_boundry, last)), 0)
+                               for start in range(first, last, self.buffer_pop_boundry))
+            if batches:
+                batches[-1] = batches[-1][:3] + (window_end, )
+        return batches
+
+    def decode_buffers(self, ID, start, stop):
+        """Decode a batch of the buffers of one device
+
+        Args:
+            ID (int): ID of the device
+            start (int): Index of the first buffer of the device to decode
+            stop (int): Index after the last buffer of the device to decode
+
+        Returns:
+            tuple(np.ndarray, np.ndarray, list[np.ndarray], np.ndarray): the headers, header times, data channels
+                                                                        and times, with one row per buffer
+        """
+        decoder = self.decoder[ID]
+        return decoder["unpack"](self.file.read_records(decoder["buffer_offsets"][start:stop],
+                                                        decoder["buffer_dtype"]))
+
+    def save_device(self, ID, headers, header_time, data, time):
+        """Pass a batch of decoded buffers of one device through its DataBuffer to the saver
+
+        Args:
+            ID (int): ID of the device
+            headers (np.ndarray): Header of each buffer
+            header_time (np.ndarray): Time of each buffer, empty if the header has no time
+            data (list[np.ndarray]): Data channels, one row per buffer
+            time (np.ndarray): Time of each packet, one row per buffer, empty if the data has no time
+        """
+        data_buffer = self.data[ID]
+        start = 0
+        while start < len(headers):
+            # Never add more than up to the pop boundry, so data is popped just as if the buffers were added one by one
+            stop = min(len(headers), start + max(1, self.buffer_pop_boundry - data_buffer.num_buffers))
+            if data_buffer.append_buffers(headers[start:stop], header_time[start:stop],
+                                          [channel[start:stop] for channel in data], time[start:stop]):
+                self.save_popped(ID, min(self.num_to_pop, data_buffer.num_buffers))
+            start = stop
 
     def read_file_header(self):
-        decoder = JSONDecoder()
-        line = self.file.readline()
-        self.header = decoder.decode(line.decode('utf-8', errors='replace')) 
+        self.header = load_header(self.file.readline())
         return self.header
 
     def generate_decoder(self):
@@ -301,27 +444,36 @@ class FileParser():
             temp.update({"data_packet_size": get_packet_size(formatting["data"])})
             temp.update({"num_packets": (formatting["buffer_size"]-(temp["header_size"]))//temp["data_packet_size"]})
             temp.update({"num_overflow_bytes": formatting["buffer_size"]-temp["num_packets"]*temp["data_packet_size"]-temp["header_size"]})
-            temp.update({"data_read_format": "<" + temp["num_packets"]*temp["data"] + temp["num_overflow_bytes"]*"x"})
+            # The layout of a whole buffer, and how to split it, so that every buffer of this ID can be read in one go
+            temp.update({"buffer_dtype": get_buffer_dtype(formatting["header"], formatting["data"],
+                                                          formatting["buffer_size"])})
+            temp.update({"unpack": get_buffer_unpacker(formatting["header"], formatting["data"])})
+            temp.update({"buffer_offsets": []})  # where each buffer of this ID starts, filled in by count_buffers
             temp.update({"num_buffers": 0})  # allocate space to count the number of buffers
             num_data_channels, _ = count_data_channels(formatting["data"])
             temp.update({"num_channels": num_data_channels})
 
             decoder.update({formatting["id"]: temp})
         self.decoder = decoder
+        self.decoder_by_id = [decoder.get(id) for id in range(256)]  # an ID byte indexes a list faster than a dict
 
-    def read_id(self):
-        """Read the ID byte of the buffer
+    def count_uniform_buffers(self, buffer_size):
+        """Count the buffers from the current file location, when they are all buffer_size long
 
-        We need the first byte which identifies from which dataset this data has come.
-        This is just a single read operation, though will return a list of bytes.
-        We thus need to get the first (and only) element of this list to get the ID.
-        This ID byte is then used by the decoder to get the right information for reading the data.
+        The ID bytes are then a strided view of the file, so they are all checked and counted at once.
 
-        Returns:
-            int: ID byte of the buffer
+        Args:
+            buffer_size (int): Size of every buffer in the file
         """
-        return self.file.read(1)[0]
-    
+        start = self.file.tell()
+        ids = np.frombuffer(self.file.mv, dtype=np.uint8)[start::buffer_size]
+        if len(np.setdiff1d(ids, list(self.decoder.keys()))):
+            raise Exception("ID is not in decoder, failed to pre-parse file")
+        for id, value in self.decoder.items():
+            value["buffer_offsets"] = start + buffer_size*np.flatnonzero(ids == id)
+            value["num_buffers"] += len(value["buffer_offsets"])
+        self.tot_buffers += len(ids)
+
     def count_buffers(self):
         """Count the number of buffers across the file for pre-allocation.
 
@@ -329,19 +481,32 @@ class FileParser():
         Otherwise, we would have no idea how to parse the file. Knowing the number of buffers
         will allow for pre-allocating a file with sizes, and is useful for testing.
         """
-        self.file.save_current_loc()  #save the current file location for parsing after
-
-        file_loc = self.file.tell()
-        while file_loc < self.file.size:
-            id = self.read_id()  #what is the current ID
-            if id not in self.decoder.keys():
-                raise Exception("ID is not in decoder, failed to pre-parse file")
-            self.decoder[id]["num_buffers"] += 1
-            self.tot_buffers += 1
-            self.file.seek(self.decoder[id]["buffer_size"]-1, 1)  #skip over the remaining bytes to get to the next ID
+        # The buffers are counted from the file map at the current file location, without moving it
+        decoder = self.decoder
+        buffer_sizes = {value["buffer_size"] for value in decoder.values()}
+        if len(buffer_sizes) == 1:  # every buffer is the same size, so the IDs are every buffer_size-th byte
+            self.count_uniform_buffers(buffer_sizes.pop())
+        else:
+            # Where a buffer starts depends on the size of the one before it, so the buffers have to be walked
+            # one by one. The walk is kept to plain ints and lists, reading the ID bytes straight from the map
+            file_bytes = self.file.mv
+            file_size = self.file.size
+            buffer_size_by_id = [0 if value is None else value["buffer_size"] for value in self.decoder_by_id]
+            offsets_by_id = [None if value is None else value["buffer_offsets"] for value in self.decoder_by_id]
             file_loc = self.file.tell()
-
-        self.file.seek(self.file.saved_loc, 0)  #go back to the saved file location to read the file data
+            while file_loc < file_size:
+                id = file_bytes[file_loc]  #what is the current ID
+                buffer_size = buffer_size_by_id[id]
+                if not buffer_size:
+                    raise Exception("ID is not in decoder, failed to pre-parse file")
+                offsets_by_id[id].append(file_loc)
+                file_loc += buffer_size  #skip over the remaining bytes to get to the next ID
+
+            # The counts follow from the offsets, rather than being kept up to date for every buffer
+            for value in decoder.values():
+                value["buffer_offsets"] = np.array(value["buffer_offsets"], dtype=np.intp)
+                value["num_buffers"] += len(value["buffer_offsets"])
+                self.tot_buffers += len(value["buffer_offsets"])
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -1,9 +1,10 @@
 import numpy as np
 from collections import deque 
+from array import array
 from pathlib import Path
-from os import stat
-from json import JSONDecoder
-from itertools import starmap, repeat, islice
+import json
+from itertools import repeat
+from functools import lru_cache
 
 # Stores the mapping from MTAG key to the size of the key
 SIZE_DICT = {"B": 1, "b": 1, # uint_8 and int_8
@@ -19,26 +20,62 @@ SIZE_DICT = {"B": 1, "b": 1, # uint_8 and int_8
 # Stores the mapping from the MTAG key to the datatype that can store the key
 # For simplicity's sake, we will use the largest type that can still store the data, saving space in the h5 file for
 # faster writing/reading from file (though we will pay a penalty on the reading side to convert INT values into floats/doubles)
-TYPE_DICT = {"B": np.int8,
-             "b": np.uint8,
-             "H": np.int16,
-             "h": np.uint16,
-             "U": np.int32,
-             "u": np.uint32,
+TYPE_DICT = {"B": np.uint8,
+             "b": np.int8,
+             "H": np.uint16,
+             "h": np.int16,
+             "U": np.uint32,
+             "u": np.int32,
              "f": np.single,
              "i": np.int32,
              "I": np.uint32,
-             "L": np.int32,
-             "l": np.uint32,
+             "L": np.uint32,
+             "l": np.int32,
              "X": np.nan,
              "x": np.nan,
              "T": np.uint64}
 
+# Stores the mapping from the MTAG key to the little-endian numpy format of the key as it is laid out in the file
+# 24-bit integers have no numpy equivalent, so are kept as their raw 3 bytes. Null bytes are left out, as they
+# only take up space in the packet
+FILE_TYPE_DICT = {"B": "u1", "b": "i1",
+                  "H": "<u2", "h": "<i2",
+                  "U": "V3", "u": "V3",
+                  "I": "<u4", "i": "<i4",
+                  "f": "<f4",
+                  "L": "<u4", "l": "<i4",
+                  "T": "<u4"}
+
+# SIZE_DICT and TYPE_DICT as tables indexed by the byte value of the (ASCII) key, so that a format can be looked up
+# through its bytes rather than hashing every character. Anything that is not a key maps to 0 and None respectively.
+# SIZE_LUT covers every byte value, so that it can also be used as a bytes.translate table
+SIZE_LUT = bytes(SIZE_DICT.get(chr(i), 0) for i in range(256))
+TYPE_LUT = tuple(TYPE_DICT.get(chr(i)) for i in range(128))
+
 MAX_TIME = 2**32 - 1
 MICROSECONDS_IN_A_SECOND = 1e6
 
-POPPER = lambda d, n: starmap(d.popleft, repeat((), n))
 
+def _format_keys(format : str):
+    """Get the byte value of each key in the format, for indexing SIZE_LUT and TYPE_LUT
+
+    Args:
+        format (str): Data packet format
+
+    Raises:
+        ValueError: If the format has a character that is not an MTAG key
+
+    Returns:
+        bytes: The keys of the format
+    """
+    keys = format.encode("ascii", errors="replace")  # "?" is not a key either
+    if not all(map(SIZE_LUT.__getitem__, keys)):
+        raise ValueError("Format {} has a character that is not an MTAG key".format(format))
+    return keys
+
+# Only a handful of formats appear in a file, so the format helpers below are cached per format string
+
+@lru_cache(maxsize=None)
 def get_packet_size(format : str):
     """Find the size of the data packet
 
@@ -48,12 +85,10 @@ def get_packet_size(format : str):
     Returns:
         int: The size of the data packet in bytes
     """
-    packet_size = 0
-    for char in format:
-        packet_size += SIZE_DICT[char]
-    return packet_size
+    return sum(_format_keys(format).translate(SIZE_LUT))  # translate maps every key to its size in one C pass
 
 
+@lru_cache(maxsize=None)
 def get_packet_type(format : str):
     """Get the type of the data packet
 
@@ -61,12 +96,162 @@ def get_packet_type(format : str):
         format (str): Data pakcet format
 
     Returns:
-        list: the type of the data packet for each channel
+        tuple: the type of the data packet for each channel
+    """
+    return tuple(map(TYPE_LUT.__getitem__, _format_keys(format)))
+
+@lru_cache(maxsize=None)
+def get_packet_dtype(format : str):
+    """Get the structured numpy type of the data packet, as it is laid out in the file
+
+    The time channel is named "T", and the data channels are named "ch0", "ch1", ... in order.
+    Null bytes are not given a field, but still take up their space in the packet.
+
+    Args:
+        format (str): Data packet format
+
+    Returns:
+        np.dtype: the type of the whole data packet
     """
-    packet_type = []
+    names, formats, offsets = [], [], []
+    offset = 0
     for char in format:
-        packet_type.append(TYPE_DICT[char])
-    return packet_type
+        if char.lower() != "x":
+            names.append("T" if char == "T" else "ch{}".format(len(names) - ("T" in names)))
+            formats.append(FILE_TYPE_DICT[char])
+            offsets.append(offset)
+        offset += SIZE_DICT[char]
+    return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": offset})
+
+@lru_cache(maxsize=None)
+def get_channel_types(format : str):
+    """Get the type of each data channel of the data packet, leaving out time and null bytes
+
+    Args:
+        format (str): Data packet format
+
+    Returns:
+        tuple: the type of each data channel, see TYPE_DICT
+    """
+    return get_packet_type("".join(char for char in format if char.lower() != "x" and char != "T"))
+
+@lru_cache(maxsize=None)
+def get_common_dtype(channel_types):
+    """Get the smallest numpy type that can hold every one of the channel types
+
+    Args:
+        channel_types (Iterable[type]): numpy type of each data channel
+
+    Returns:
+        np.dtype: the common type of the channels, float64 if there are none
+    """
+    return np.result_type(*channel_types) if channel_types else np.dtype(np.float64)
+
+def get_data_dtype(format : str):
+    """Get the smallest numpy type that can hold every data channel of the data packet
+
+    Args:
+        format (str): Data packet format
+
+    Returns:
+        np.dtype: the common type of the data channels, float64 if there are none
+    """
+    return get_common_dtype(get_channel_types(format))
+
+def _widen_24_bit(raw, signed):
+    """Convert raw little-endian 24-bit values into 32-bit integers
+
+    Args:
+        raw (np.ndarray): 24-bit values, as a "V3" array
+        signed (bool): whether the values are signed
+
+    Returns:
+        np.ndarray: the values as int32 if signed, else uint32
+    """
+    # Copy the 3 bytes of each value into 4 byte slots, so they can be read as 32-bit integers in place
+    widened = np.zeros(raw.shape + (4, ), dtype=np.uint8)
+    if signed:
+        # Into the top 3 bytes, so that an arithmetic shift back down sign extends them
+        widened[..., 1:] = np.ascontiguousarray(raw).view(np.uint8).reshape(raw.shape + (3, ))
+        return widened.view("<i4")[..., 0] >> 8
+    widened[..., :3] = np.ascontiguousarray(raw).view(np.uint8).reshape(raw.shape + (3, ))
+    return widened.view("<u4")[..., 0]
+
+@lru_cache(maxsize=None)
+def get_packet_unpacker(format : str):
+    """Build a function that splits data packets of the given format into their channels
+
+    Everything that depends only on the format (which fields are time or 24-bit) is worked out here once,
+    so that unpacking is a view of each field plus whatever 24-bit widening the format needs.
+
+    Args:
+        format (str): Data packet format
+
+    Returns:
+        Callable[[np.ndarray], tuple]: function taking an array of packets (of the format's get_packet_dtype, in any
+                                       shape) and returning the list of data channels and the time channel
+                                       ([] if the format has no time), each in the shape of the packet array
+    """
+    packet_names = get_packet_dtype(format).names
+    has_time = "T" in format
+    # (field name, signedness for 24-bit channels or None for those numpy can read directly)
+    channels = tuple((name, char == "u" if char.lower() == "u" else None)
+                     for name, char in zip(packet_names, (c for c in format if c.lower() != "x"))
+                     if name != "T")
+
+    def unpack(packets):
+        data = [packets[name] if signed is None else _widen_24_bit(packets[name], signed) for name, signed in channels]
+        time = packets["T"] if has_time else []
+        return data, time
+
+    return unpack
+
+@lru_cache(maxsize=None)
+def get_buffer_dtype(header_format : str, data_format : str, buffer_size : int):
+    """Get the structured numpy type of a whole buffer, as it is laid out in the file
+
+    The ID byte is field "id", the rest of the header is field "header" (see get_packet_dtype), and the
+    data packets are field "packets", as many as fit in the buffer. Any bytes left over are left as a gap.
+
+    Args:
+        header_format (str): Buffer header format, starting with the ID byte
+        data_format (str): Data packet format
+        buffer_size (int): Size of the whole buffer in bytes
+
+    Returns:
+        np.dtype: the type of the whole buffer
+    """
+    header_size = get_packet_size(header_format)
+    num_packets = (buffer_size - header_size)//get_packet_size(data_format)
+    return np.dtype({"names": ["id", "header", "packets"],
+                     "formats": ["u1", get_packet_dtype(header_format[1:]),
+                                 (get_packet_dtype(data_format), (num_packets, ))],
+                     "offsets": [0, 1, header_size],
+                     "itemsize": buffer_size})
+
+@lru_cache(maxsize=None)
+def get_buffer_unpacker(header_format : str, data_format : str):
+    """Build a function that splits buffers of the given formats into their header and data channels
+
+    Args:
+        header_format (str): Buffer header format, starting with the ID byte
+        data_format (str): Data packet format
+
+    Returns:
+        Callable[[np.ndarray], tuple]: function taking an array of buffers (of get_buffer_dtype) and returning
+                                       their headers, header times ([] if the header has no time), data
+                                       channels and times ([] if the data has no time), one row per buffer
+    """
+    header_has_time = "T" in header_format
+    unpack_packets = get_packet_unpacker(data_format)
+
+    def unpack(buffers):
+        headers = buffers["header"]
+        header_time = headers["T"] if header_has_time else []
+        data, time = unpack_packets(buffers["packets"])
+        return headers, header_time, data, time
+
+    return unpack
 
 def correct_format(format : str):
     """Replace custom format string with struct/rawutil compatible string
@@ -94,7 +279,7 @@ def count_data_channels(format : str):
     Returns:
         tuple[int]: The number of data channels and number of time channels
     """
-    data_channels = len(format)
+    data_channels = len(format) - format.lower().count("x")  # null bytes only pad the packet
     time_channels = 0
     if format.find("T") != -1:
         data_channels -= 1
@@ -102,17 +287,19 @@ def count_data_channels(format : str):
     return data_channels, time_channels
 
 
-def consume(iter, n=None):
-    """Consume as fast as possible the iterable
+def drop(queue, n):
+    """Remove n elements from the front of the queue, without keeping them
 
     Args:
-        iter (Iterable[Any]): Iterable to consume.
-        n (int, optional): Number of elements to consume. Defaults to None. If is None, entirety of the iterator will be consumed.
+        queue (deque[Any]): Queue to remove from.
+        n (int): Number of elements to remove.
     """
-    if n is None:
-        deque(iter, maxlen=0)
+    if n == len(queue):
+        queue.clear()
     else:
-        next(islice(iter, n, n), None)
+        popleft = queue.popleft
+        for _ in repeat(None, n):
+            popleft()
 
 
 def unwrapper(values, max_number, bad_frac=0.5):
@@ -121,8 +308,9 @@ def unwrapper(values, max_number, bad_frac=0.5):
 
     Parameters
     ----------
-    values : iterable
-        Array of values to sort.
+    values : numpy array
+        Array of values to sort. An int64 array is unwrapped in place and
+        returned, anything else is first copied into a new int64 array.
     max_number : int
         The maximum expected value before an overflow
     bad_frac : float, optional
@@ -137,14 +325,29 @@ def unwrapper(values, max_number, bad_frac=0.5):
         Sorted array values
     int
         Number of overflows
+
+    Raises
+    ------
+    ValueError
+        If an out of order run (a large positive difference) is neither closed
+        by an overflow after it nor left over from an overflow before it
     """
-    # Figure out overflow boundries
-    items = np.asarray(values)
+    # Figure out overflow boundries. The differences are computed once and kept
+    # up to date as items is adjusted, rather than being recomputed for each pass
+    # int64, so that subtracting max_number goes negative rather than wrapping around
+    items = np.asarray(values, dtype=np.int64)
+    threshold = bad_frac * max_number
+    diffs = np.diff(items)
+    # Overflows are rare, so most calls have nothing to adjust: check for that without building any masks
+    if not len(diffs) or (diffs.min() > -threshold and diffs.max() < threshold):
+        return items, 0
     # large positive diffs indicate wrong order around an overflow
     # (i.e. an ordering of [254 0 255] for the count indices)
     # This is an assumption, but a fairly valid one, as the hardware should
     # not miss 127 buffer writes.
-    large_pos_diffs = np.where(np.diff(items) >= bad_frac * max_number)[0]
+    large_pos_diffs = np.flatnonzero(diffs >= threshold)
+    # large negative diffs indicate integer overflow
+    large_neg_diffs = np.flatnonzero(diffs <= -threshold)
 
     # Now adjust for the errors that occur when the items were written
     # in the wrong order around an overflow
@@ -153,26 +356,53 @@ def unwrapper(values, max_number, bad_frac=0.5):
     # [253, 0, 254, 255, 1] -> [253, 0, -2, -1, 1]
     # Therefore, after finding  a large_pos_diffs, for each of these we need to
     # find where after a large_pos_diff we have a negative_pos_diff
-    for index in large_pos_diffs:
-        # subtract out max_number just from the element at this index and any
-        # that are close by
-        end_offset = np.where(
-            np.diff(items[(index+1):]) <= -bad_frac*max_number)[0][0]
-        items[(index+1):(index+1+end_offset+1)] -= max_number
-
-    # large negative diffs indicate integer overflow
-    large_neg_diffs = np.where(np.diff(items) <= -bad_frac * max_number)[0]
+    if len(large_pos_diffs):
+        # subtract out max_number just from the elements after each of these, up to
+        # the next overflow (or the end of items). Each run is marked at its start and
+        # end in a difference array, so a single cumsum adjusts all of them at once
+        next_neg = np.searchsorted(large_neg_diffs, large_pos_diffs+1)
+        closed = next_neg < len(large_neg_diffs)
+        # A run with no overflow after it may only run to the end of items if it is made up of
+        # the items left over from an earlier overflow ([254 0 255]), that is, if there is an
+        # overflow before it that does not already close another run ([100 253 0 254] has none)
+        if not closed[-1] and len(large_neg_diffs) <= len(np.unique(next_neg[closed])):
+            raise ValueError("Out of order run at index {} is not closed by an overflow in values".format(
+                large_pos_diffs[np.argmin(closed)]+1))
+        end_indices = np.append(large_neg_diffs, len(diffs))[next_neg]
+        adjust = np.zeros(len(items)+1, dtype=np.int64)
+        np.add.at(adjust, large_pos_diffs+1, -max_number)
+        np.add.at(adjust, end_indices+1, max_number)
+        items += np.cumsum(adjust[:-1])
+        np.subtract.at(diffs, large_pos_diffs, max_number)
+        np.add.at(diffs, end_indices[end_indices < len(diffs)], max_number)
+        large_neg_diffs = np.flatnonzero(diffs <= -threshold)
 
     # Only now correct for overflow
     # [254 0 255] -> [254 0 -1] (from large pos_dif) -> [254 256 255]
     # (from this large neg_diffs, meaning we are ready to sort
-    for index in large_neg_diffs:
-        # add max_number to each element from this index onwards
-        items[(index+1):] += max_number
+    # each element gets max_number added once for every overflow before it
+    overflows = np.zeros(len(items), dtype=np.int64)
+    overflows[large_neg_diffs+1] = max_number
+    items += np.cumsum(overflows)
 
     return items, len(large_neg_diffs)
 
 
+def load_header(content : bytes):
+    """Parse a JSON file header
+
+    Args:
+        content (bytes): The header, as read from file
+
+    Returns:
+        dict: Dictionary representation of the header
+    """
+    try:  # json parses the bytes directly, without us decoding them to a str first
+        return json.loads(content)
+    except UnicodeDecodeError:  # still parse headers with stray bytes that are not UTF-8
+        return json.loads(content.decode('utf-8', errors='replace'))
+
+
 def import_external_header(filename : str | Path):
     """Imports external header for parsing
 
@@ -182,12 +412,8 @@ def import_external_header(filename : str | Path):
     Returns:
         dict: Dictionary representation of the header
     """
-    file_size = stat(filename).st_size
-    decoder = JSONDecoder()
-    with open(filename, 'r') as f:
-        data = f.read(file_size)
-        header = decoder.decode(data)
-    return header
+    with open(filename, 'rb') as f:
+        return load_header(f.read())
 
 class DataWrite:
     def __init__(self, time, data, chunk_size):
@@ -195,29 +421,32 @@ class DataWrite:
         self.data = data
         self.chunk_size = chunk_size
 
-    def sub_chunks(self):
-        """Generate chunk sized array from the time and data that is to be written
-
-        Yields:
-            tuple(Iterable[Any], Iterable[Any]): time and data chunk of larger array
-        """
-        assert(len(self.time) % self.chunk_size == 0, "Length of time must be a multiple of chunk_size")
-        num_chunks = len(self.time)//self.chunk_size
-        for i in range(num_chunks):
-            yield self.time[self.chunk_size*i : (self.chunk_size*(i+1))], self.data[self.chunk_size*i : (self.chunk_size*(i+1)), :] 
-
 
 class DataBuffer():
-    def __init__(self, header_data=deque(), header_time=deque(), data=deque(), time=deque(), pop_boundry=1280, chunk_size=1):
+    def __init__(self, header_data=deque(), header_time=deque(), pop_boundry=1280, chunk_size=1,
+                 channel_types=(), has_time=False, initial_capacity=1, keep_header_data=False,
+                 split_channels=False):
         self.header_data    = header_data
-        self.header_time    = header_time
-        self.time           = time
-        self.data           = data
+        self.keep_header_data = keep_header_data  # header_data is not used yet, so by default it is not stored at all
+        # One uint32 time per buffer, kept contiguous rather than as a deque of Python ints
+        self.header_time    = array("I", header_time)
+        # The time of each sample, if the data comes with time, is stored just like a data channel
+        self.time           = np.empty(initial_capacity, dtype=np.uint32) if has_time else None
+        self.channel_types  = channel_types  # numpy type of each data channel, see TYPE_DICT
+        # popped data is stored in a type all the channels fit in, rather than always in float64
+        self.data_dtype     = get_common_dtype(channel_types)  # the same type the saved data dataset is created with
+        # Each data channel is its own typed array (structure of arrays), sharing a head/tail index with time:
+        # samples in [head, tail) are waiting to be popped
+        self.data           = [np.empty(initial_capacity, dtype=channel_type) for channel_type in channel_types]
+        self.head           = 0
+        self.tail           = 0
         self.time_offset    = 0
         self.num_buffers    = 0
         self.last_time      = 0
         self.pop_boundry    = pop_boundry
         self.chunk_size     = chunk_size
+        # popped channels are handed over as they are stored, rather than put together as the columns of one array
+        self.split_channels = split_channels
 
     def append_raw_data(self, header_data, header_time, data, time):
         """Extend the underlying data buffer with new data
@@ -228,21 +457,18 @@ class DataBuffer():
 
         Args:
             header_data (deque[Any]): Data coming from the header. Can be empty.
-            header_time (deque[Any]): Time data coming from the header. Can be empty.
-            time (deque[Any]): Time data associated with sampling. Can be empty.
-            data (deque[Any]): Data associated with sampling. Can be empty.
+            header_time (int): Time data coming from the header. Can be empty.
+            time (Iterable[Any]): Time data associated with sampling. Can be empty.
+            data (Iterable[Iterable[Any]]): Data associated with sampling. Can be empty.
         """
-        if header_data:  # implicitly check if we passed this
+        if header_data and self.keep_header_data:  # implicitly check if we passed this
             self.header_data.append(header_data)
 
         if header_time:
             self.header_time.append(header_time)
 
-        if time:
-            self.time.extend(time)
-
-        if data:
-            self.extend_data(data)
+        if len(data) or len(time):
+            self.extend_data(data, time)
 
         self.num_buffers += 1
         
@@ -251,14 +477,80 @@ class DataBuffer():
 
         return self.num_buffers >= self.pop_boundry
 
-    def extend_data(self, data):
-        """Extends the individual data channels for this DataBuffer
+    def append_buffers(self, header_data, header_time, data, time):
+        """Extend the underlying data buffer with several buffers of new data at once
+
+        The batch equivalent of append_raw_data, with one row per buffer.
+
+        Args:
+            header_data (np.ndarray): Data coming from the headers. Can be empty.
+            header_time (np.ndarray): Time data coming from the headers, one per buffer. Can be empty.
+            data (Iterable[np.ndarray]): Data associated with sampling, one (buffers x packets) array per channel.
+            time (np.ndarray): Time data associated with sampling, (buffers x packets). Can be empty.
+
+        Returns:
+            bool: Whether the DataBuffer has reached its pop boundry
+        """
+        if len(header_data) and self.keep_header_data:
+            self.header_data.extend(header_data)
+
+        if len(header_time):
+            self.header_time.frombytes(np.ascontiguousarray(header_time, dtype=np.uint32).view(np.uint8))
+
+        if len(data) or len(time):
+            self.extend_data([channel.ravel() for channel in data], np.ravel(time))
+
+        self.num_buffers += max(len(header_time), len(time), len(data[0]) if len(data) else 0)
+
+        if self.num_buffers != len(self.header_time):
+            raise AssertionError("Num buffers should be equal to length of header_time")
+
+        return self.num_buffers >= self.pop_boundry
+
+    def extend_data(self, data, time=()):
+        """Extends the individual data channels, and time, for this DataBuffer
 
         Args:
             data (Iterable[Iterable[Any]]): An array of arrays, with each internal array corresponding to the data channels
+            time (Iterable[Any]): Time of each sample. Can be empty, if the data does not come with time.
+        """
+        num_samples = len(data[0]) if len(data) else len(time)
+        self._ensure_capacity(num_samples)
+        start, end = self.tail, self.tail + num_samples
+        for (channel, data_channel) in zip(self.data, data):
+            channel[start:end] = data_channel
+        if len(time):
+            self.time[start:end] = time
+        self.tail = end
+
+    def _ensure_capacity(self, num_samples):
+        """Make room for num_samples more samples at the tail of the data channels
+
+        Samples still waiting to be popped are first moved back to the start of the channel
+        arrays. Only if that does not free enough room are the arrays grown, doubling in size
+        so that the copies are amortized over many buffers.
+
+        Args:
+            num_samples (int): Number of samples about to be added to each channel
         """
-        for (i, data_channel) in enumerate(data):
-            self.data[i].extend(data_channel)
+        arrays = self.data if self.time is None else self.data + [self.time]
+        if not arrays or self.tail + num_samples <= len(arrays[0]):
+            return
+
+        num_waiting = self.tail - self.head
+        capacity    = len(arrays[0])
+        if num_waiting + num_samples > capacity:
+            capacity = max(2*capacity, num_waiting + num_samples)
+
+        for (i, channel) in enumerate(arrays):
+            if capacity > len(channel):
+                arrays[i] = np.empty(capacity, dtype=channel.dtype)
+            arrays[i][:num_waiting] = channel[self.head:self.tail]
+        self.data = arrays[:len(self.data)]
+        if self.time is not None:
+            self.time = arrays[-1]
+        self.head = 0
+        self.tail = num_waiting
 
     def pop_data(self, num_buffer_to_pop: int, num_packets_per_buffer: int, num_channels : int) -> DataWrite:
         """Number of buffers to pop off the queue ready for writing
@@ -278,51 +570,58 @@ class DataBuffer():
             num_channels(int): The number of data channels per sampling event
 
         Returns:
-            DataWrite: An object from which we can grab data for running
+            DataWrite: An object from which we can grab data for running. With split_channels, its data
+                is a list of per channel arrays that view the buffer, and are only valid until it is next
+                appended to.
         """
         len_data     = num_buffer_to_pop*num_packets_per_buffer
 
-        data = np.zeros(shape=(len_data, num_channels))
+        start, end = self.head, self.head + len_data
 
         #if we only have header_time and not time, use header_time
         # self.header_time is true if self.header_time is not empty
-        # self.time is true if self.time is not empty
-        if self.header_time and not self.time:
-            popped_times = [self.last_time]
-            #popped_times.extend([self.header_time.popleft() for _ in range(num_buffer_to_pop)])
-            popped_times.extend(POPPER(self.header_time, num_buffer_to_pop))
+        # self.time is None if the data does not come with time
+        if self.header_time and self.time is None:
+            popped_times = np.empty(num_buffer_to_pop+1, dtype=np.int64)
+            popped_times[0] = self.last_time
+            popped_times[1:] = np.frombuffer(self.header_time, dtype=np.uint32, count=num_buffer_to_pop)
+            self.last_time = popped_times[-1]  # kept as read, before popped_times is unwrapped in place
+            del self.header_time[:num_buffer_to_pop]
             # We have popped the times, but now we need to unwrap them if we overflowed
-            pre_time, num_overflows = unwrapper(popped_times, max_number=MAX_TIME, bad_frac=0.5)            
-            time     = np.zeros(shape=(num_packets_per_buffer*num_buffer_to_pop, ))
-            # We assume a constant sampling rate in between the buffers. So we can reinterpolate between the time bounds
-            for i in range(num_buffer_to_pop):
-                time[i*num_packets_per_buffer : (i+1)*num_packets_per_buffer] = np.linspace(popped_times[i], popped_times[i+1], num_packets_per_buffer+1)[1:]
-            self.last_time = time[-1]
-        elif self.time: #if time is an empty deque, this will be false
-            #pre_time = self.time_offset + np.asarray([ self.time.popleft() for _ in range(len_data) ] )
-            pre_time = self.time_offset + np.asarray(list(POPPER(self.time, len_data)))
+            pre_time, num_overflows = unwrapper(popped_times, max_number=MAX_TIME, bad_frac=0.5)
+            # We assume a constant sampling rate in between the buffers. So we can reinterpolate between the time bounds,
+            # for all buffers at once: row i runs from buffer time i (exclusive) to buffer time i+1 (inclusive)
+            fraction = np.arange(1, num_packets_per_buffer+1) / num_packets_per_buffer
+            starts   = pre_time[:-1, np.newaxis]
+            time     = (self.time_offset + starts + (pre_time[1:, np.newaxis] - starts)*fraction).reshape(-1)
+        elif self.time is not None:
+            # int64 so that unwrapper can subtract without wrapping around
+            pre_time = self.time[start:end].astype(np.int64)
+            pre_time += self.time_offset
             # We have popped the times, but now we need to unwrap them if we overflowed
             time, num_overflows = unwrapper(pre_time, max_number=MAX_TIME, bad_frac=0.5)
             # IMPORTANT: for this case, it is possible to have header_time, we are just not using it.
             # And so, we must pop the times to ensure that we don't overfill the deque and take up
             # valuable space
-            if self.header_time:
-                consume(POPPER(self.header_time, num_buffer_to_pop))
+            del self.header_time[:num_buffer_to_pop]
         else:  # where has the time gone... it is not in the buffer
-            raise("We have no way to get time, passed in neither header nor with data\n")
+            raise Exception("We have no way to get time, passed in neither header nor with data\n")
 
         # We get rid of header_data for now, as we are not using it in the current versions
         if self.header_data:
-            consume(POPPER(self.header_time, num_buffer_to_pop))
+            drop(self.header_data, num_buffer_to_pop)
 
         # Adjust the time offset based on overflows
         self.time_offset += num_overflows*MAX_TIME
 
         # Pop the data channels individually for the deserialization
-        for (i, channel_data) in enumerate(self.data):
-            #temp = [ channel_data.popleft() for _ in range(len_data) ]
-            temp = list(POPPER(channel_data, len_data))
-            data[:, i] = temp
+        if self.split_channels:  # each channel is written on its own, so they can be written straight from here
+            data = [channel_data[start:end] for channel_data in self.data]
+        else:
+            data = np.empty(shape=(len_data, num_channels), dtype=self.data_dtype)  # every row is filled in below
+            for (i, channel_data) in enumerate(self.data):
+                data[:, i] = channel_data[start:end]
+        self.head = end
 
         self.num_buffers -= num_buffer_to_pop  # update the number of buffers based on the amount that was popped
 
@@ -333,8 +632,7 @@ class DataBuffer():
 
         For some reason it was needed to write this function so that pytest would run as expected.
         """
-        self.header_time = deque()
+        self.header_time = array("I")
         self.header_data = deque()
-        self.time        = deque()
-        for (i, _) in enumerate(self.data):
-            self.data[i] = deque()
+        self.head        = 0
+        self.tail        = 0
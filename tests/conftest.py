@@ -0,0 +1,16 @@
+import pytest
+from pathlib import Path
+
+from animal_tag.serializer.utils import import_external_header
+
+THIS_DIR = Path(__file__).parent
+
+
+@pytest.fixture(scope="session")
+def external_header():
+    """The external header in Data, parsed once for every test that only reads it
+
+    Returns:
+        dict: The parsed header
+    """
+    return import_external_header(THIS_DIR / "Data/test_header.txt")
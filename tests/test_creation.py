@@ -2,12 +2,15 @@ import pytest
 from pathlib import Path
 
 import itertools
+import json
+import types
 import h5py
 import numpy as np
 
 from animal_tag.serializer.buffer_generator import DataBuffer
-from animal_tag.serializer.deserializer import FileReader, FileParser
-from animal_tag.serializer.utils import get_packet_size, count_data_channels, import_external_header
+from animal_tag.serializer import deserializer
+from animal_tag.serializer.deserializer import FileReader, FileParser, FileSaver
+from animal_tag.serializer.utils import get_packet_size, count_data_channels, DataWrite
 from os.path import exists as os_file_exists
 
 ID        = [1]
@@ -38,14 +41,27 @@ def get_buffer_combinations():
          num_buff, metadata, buff_name) in enumerate(itertools.product(ID, HEADER, DATA, SIZE, VAL, TIME, CH_SP,
                                                                        NUM_BUFF, METADATA, BUFF_NAME)):
         filename = "TestFile{}.bin".format(file_num)
-        ch_names = ["ch{}".format(i) for i in range(len(data))]
+        ch_names = ["ch{}".format(i) for i in range(count_data_channels(data)[0])]
         correct_size = max(size, get_packet_size(header)+get_packet_size(data))  # ensures passed size is valid
 
         yield {"filename": filename, "params": (id, time, header, data, correct_size, val,
                                                 ch_sp, num_buff, metadata, buff_name, ch_names)}
 
 
-@pytest.fixture(scope="session", params=list(get_buffer_combinations()))
+def buffer_combination_id(combination):
+    """Short test id naming what varies between buffer combinations, e.g. BTx-HB-8192-split-1280"""
+    (id, time, header, data, size, val, ch_sp, num_buff, metadata, buff_name, ch_names) = combination["params"]
+    return "{}-{}-{}-{}-{}".format(header, data, size, "split" if ch_sp else "joined", num_buff)
+
+
+def pytest_generate_tests(metafunc):
+    # Only tests that use write_bin_file are parametrized over the buffer combinations
+    if "write_bin_file" in metafunc.fixturenames:
+        metafunc.parametrize("write_bin_file", list(get_buffer_combinations()), ids=buffer_combination_id,
+                             indirect=True, scope="session")
+
+
+@pytest.fixture(scope="session")
 def write_bin_file(request, tmp_path_factory):
     """Generate temporary files with assorted settings
 
@@ -147,13 +163,12 @@ def test_buffer_data_initialize(write_bin_file):
     num_buffers = write_bin_file["buffer"].num_buffers
     expected_num_data_channels, _ = count_data_channels(write_bin_file["buffer"].data_format)
 
-    for i in range(num_buffers):
-        (id, header_data, header_time, data, time) = fp.read_data_buffer()
-        assert header_time % write_bin_file["buffer"].time == 0
-        assert len(data) == expected_num_data_channels
-        for channels in data:
-            for element in channels:
-                assert element == write_bin_file["buffer"].value
+    headers, header_time, data, time = fp.decode_buffers(ID[0], 0, num_buffers)
+    assert len(headers) == num_buffers
+    assert np.all(header_time % write_bin_file["buffer"].time == 0)
+    assert len(data) == expected_num_data_channels
+    for channels in data:
+        assert np.all(channels == write_bin_file["buffer"].value)
 
 def test_buffer_parsing(write_bin_file):
     """Test the parsing of a buffer
@@ -167,19 +182,230 @@ def test_buffer_parsing(write_bin_file):
 
     with h5py.File(write_bin_file["savefile"], "r") as f:
         time = f['test']['time'][:]
-        data = f['test']['data'][:]
+        if write_bin_file["buffer"].split_channel:  # one dataset per channel
+            data = np.stack([f['test']['data'][name][:] for name in write_bin_file["buffer"].channel_names], axis=1)
+        else:
+            data = f['test']['data'][:]
         assert len(time) > 0
         assert len(data) > 0
+        assert data.shape == (len(time), len(write_bin_file["buffer"].channel_names))
         assert all(np.diff(time) > 0)
         for d in data.flat:
             assert d == write_bin_file["buffer"].value
 
-def test_external_header_parsing(write_bin_file):
-    file_path = THIS_DIR / "Data/test_header.txt"
+def test_header_saving(tmp_path):
+    filename = tmp_path / "header.h5"
+    saver = FileSaver(str(filename))
+    saver.save_header({"metadata": {"name": "Gabriel", "count": 3, "missing": None},
+                       "gains": [1.0, 2.0, 4.0]})
+    saver.close_file()
+
+    with h5py.File(filename, 'r') as f:
+        assert f['metadata'].attrs['name'] == "Gabriel"
+        assert f['metadata'].attrs['count'] == 3
+        assert np.isnan(f['metadata'].attrs['missing'])
+        assert np.array_equal(f['gains'][:], [1.0, 2.0, 4.0])
+
+
+def test_save_data_whole_buffers(tmp_path):
+    saver = FileSaver(str(tmp_path / "partial.h5"))
+    with pytest.raises(ValueError):  # 5 samples are not a whole number of 3 sample buffers
+        saver.save_data("test", DataWrite(time=np.arange(5), data=np.zeros((5, 2)), chunk_size=3))
+    saver.close_file()
+
+
+@pytest.mark.parametrize("split_channel", [True, False])
+def test_channel_names_must_match_data(tmp_path, split_channel):
+    bin_file = tmp_path / "names.bin"
+    # "HB" has two data channels, but only one is named
+    DataBuffer(bin_file, 1, 4093, "BTx", "HB", 64, 2, split_channel, 3, METADATA[0], "test", ["ch0"]).write_file()
+    fp = FileParser(bin_file, tmp_path / "names.h5")
+    with pytest.raises(ValueError, match="channel names"):
+        fp.parse()
+
+
+def test_channel_names_unchecked_without_buffers(tmp_path):
+    # The second device is only declared in the header, so its channel names are never used
+    devices = interleaved_devices((64, 64))
+    devices[1].channel_names = ["c", "d"]
+    write_interleaved_file(tmp_path / "declared.bin", devices, [0]*3)
+    FileParser(tmp_path / "declared.bin", tmp_path / "declared.h5").parse()
+    check_saved_devices(tmp_path / "declared.h5", devices[:1])
+
+
+def test_split_channel_defaults_to_joined(tmp_path):
+    devices = interleaved_devices((64, 64))[:1]
+    write_interleaved_file(tmp_path / "joined.bin", devices, [0]*3)
+    # Drop split_channel from the header, leaving the buffers after it as they are
+    header, buffers = (tmp_path / "joined.bin").read_bytes().split(b'\n', 1)
+    header = json.loads(header)
+    del header["buffers"]["first"]["split_channel"]
+    (tmp_path / "joined.bin").write_bytes(json.dumps(header).encode('utf-8') + b'\n' + buffers)
+
+    FileParser(tmp_path / "joined.bin", tmp_path / "joined.h5").parse()
+    with h5py.File(tmp_path / "joined.h5", "r") as f:
+        assert isinstance(f['first']['data'], h5py.Dataset)
+    check_saved_devices(tmp_path / "joined.h5", devices)
+
+
+def interleaved_devices(buffer_sizes):
+    """Two devices, one with joined and one with split channels, for files that interleave their buffers
+
+    Args:
+        buffer_sizes (tuple(int, int)): The buffer size of each device
+
+    Returns:
+        list[DataBuffer]: The buffer writer of each device. Only their create_buffer is used, not their own file.
+    """
+    return [DataBuffer("", 1, 1000, "BTx", "HB", buffer_sizes[0], 7, False, 0, METADATA[0], "first", ["a", "b"]),
+            DataBuffer("", 2, 500, "BTx", "H", buffer_sizes[1], 9, True, 0, METADATA[0], "second", ["c"])]
+
+
+def write_interleaved_file(bin_file, devices, order):
+    """Write a file with the buffers of several devices interleaved
+
+    Args:
+        bin_file (Path): Where to write the file
+        devices (list[DataBuffer]): The buffer writer of each device
+        order (list[int]): Which device each buffer of the file belongs to, as an index into devices
+
+    Returns:
+        dict[int, list[int]]: Where each buffer of each device starts in the file, by ID
+    """
+    header = {"metadata": METADATA[0], "buffers": {}}
+    for device in devices:
+        header["buffers"].update(device.create_file_header()["buffers"])
+    parts = [json.dumps(header).encode('utf-8') + b'\n']
+
+    offsets = {device.id: [] for device in devices}
+    file_loc = len(parts[0])
+    for device in (devices[i] for i in order):
+        device.num_buffers += 1
+        offsets[device.id].append(file_loc)
+        parts.append(device.create_buffer(id=device.id, time=device.num_buffers*device.time,
+                                          header_format=device.header_format, data_format=device.data_format,
+                                          buffer_size=device.buffer_size, value=device.value))
+        file_loc += device.buffer_size
+
+    with open(bin_file, 'wb') as f:
+        f.write(b''.join(parts))
+    return offsets
+
+
+def read_saved_devices(savefile, devices):
+    """Read back the time and data saved for each device, with the data as one column per channel"""
+    saved = {}
+    with h5py.File(savefile, "r") as f:
+        for device in devices:
+            group = f[device.buffer_name]
+            if device.split_channel:
+                data = np.stack([group['data'][name][:] for name in device.channel_names], axis=1)
+            else:
+                data = group['data'][:]
+            saved[device.buffer_name] = (group['time'][:], data)
+    return saved
+
+
+def check_saved_devices(savefile, devices):
+    """Check that the saved time and data of each device are the ones its buffers were written with"""
+    for device in devices:
+        time, data = read_saved_devices(savefile, devices)[device.buffer_name]
+        num_packets = (device.buffer_size - get_packet_size(device.header_format))//get_packet_size(device.data_format)
+        # the buffer times are spread evenly over the packets of each buffer
+        expected_time = np.arange(1, device.num_buffers*num_packets + 1)*device.time/num_packets/1e6
+        assert np.allclose(time, expected_time)
+        assert data.shape == (device.num_buffers*num_packets, len(device.channel_names))
+        assert np.all(data == device.value)
+
+
+def test_interleaved_devices_windowed(tmp_path, monkeypatch):
+    # Map even this small file, and decode it a few pages at a time, so that the records of each device are
+    # gathered from between the other's and the windows are let go of as the file is gone through
+    monkeypatch.setattr(deserializer, "MAP_FILE_SIZE", 1)
+    monkeypatch.setattr(deserializer, "DECODE_WINDOW_SIZE", 1 << 13)
+    released = []
+    release = FileReader.release
+
+    def record_release(self, start, end):
+        released.append((start, end))
+        release(self, start, end)
+    monkeypatch.setattr(FileReader, "release", record_release)
+
+    devices = interleaved_devices((64, 64))
+    write_interleaved_file(tmp_path / "interleaved.bin", devices, [0, 1, 1]*200)
+    fp = FileParser(tmp_path / "interleaved.bin", tmp_path / "interleaved.h5", num_to_pop=8, buffer_pop_boundry=16)
+    fp.parse()
+
+    windows = released[1:]  # the first release is of the whole file, after counting
+    assert len(windows) == -(-fp.file.size // (1 << 13))
+    assert windows[0][0] == 0 and windows[-1][1] == fp.file.size
+    assert all(previous[1] == window[0] for previous, window in zip(windows, windows[1:]))
+    check_saved_devices(tmp_path / "interleaved.h5", devices)
+
+
+def test_mixed_buffer_sizes(tmp_path):
+    # The buffers no longer start every buffer_size bytes, so count_buffers has to walk them one by one
+    devices = interleaved_devices((64, 100))
+    offsets = write_interleaved_file(tmp_path / "mixed.bin", devices, [0, 1, 1, 0, 1]*20)
+
+    fp = FileParser(tmp_path / "mixed.bin", tmp_path / "mixed.h5", num_to_pop=8, buffer_pop_boundry=16)
+    fp.open_file()
+    fp.read_file_header()
+    fp.generate_decoder()
+    fp.count_buffers()
+    for device in devices:
+        assert fp.decoder[device.id]["num_buffers"] == device.num_buffers
+        assert fp.decoder[device.id]["buffer_offsets"].tolist() == offsets[device.id]
+    assert fp.tot_buffers == sum(device.num_buffers for device in devices)
+    fp.file.close_file()
+    fp.saver.close_file()
+
+    FileParser(tmp_path / "mixed.bin", tmp_path / "mixed.h5", num_to_pop=8, buffer_pop_boundry=16).parse()
+    check_saved_devices(tmp_path / "mixed.h5", devices)
+
+
+class DecodeOnResult:
+    """Stands in for the ThreadPoolExecutor of FileParser.parse, so that nothing is decoded ahead
+
+    A batch is only decoded once its result is asked for, that is, after the batch before it has been saved
+    and its window released.
+    """
+    def __init__(self, max_workers):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, fn, *args):
+        return types.SimpleNamespace(result=lambda: fn(*args))
+
+
+def test_prefetch_matches_decoding_in_turn(tmp_path, monkeypatch):
+    monkeypatch.setattr(deserializer, "MAP_FILE_SIZE", 1)
+    monkeypatch.setattr(deserializer, "DECODE_WINDOW_SIZE", 1 << 13)
+    devices = interleaved_devices((64, 64))
+    write_interleaved_file(tmp_path / "prefetch.bin", devices, [0, 1, 1]*200)
+
+    # Several pop sized batches per device in every window, so a batch is often decoded ahead across a window edge
+    FileParser(tmp_path / "prefetch.bin", tmp_path / "prefetch.h5", num_to_pop=8, buffer_pop_boundry=16).parse()
+    monkeypatch.setattr(deserializer, "ThreadPoolExecutor", DecodeOnResult)
+    FileParser(tmp_path / "prefetch.bin", tmp_path / "in_turn.h5", num_to_pop=8, buffer_pop_boundry=16).parse()
+
+    prefetched = read_saved_devices(tmp_path / "prefetch.h5", devices)
+    in_turn = read_saved_devices(tmp_path / "in_turn.h5", devices)
+    for device in devices:
+        for (prefetched_set, in_turn_set) in zip(prefetched[device.buffer_name], in_turn[device.buffer_name]):
+            assert np.array_equal(prefetched_set, in_turn_set)
+    check_saved_devices(tmp_path / "prefetch.h5", devices)
+
 
+def test_external_header_parsing(write_bin_file, external_header):
     # A little dirty since we repeat this test an unnecessary amount of times, but gooed enough for now
     fp = FileParser(write_bin_file["file"], write_bin_file["savefile"]) # we just want a dummy file here to see if we can import a decoder
-    fp.header = import_external_header(file_path)
+    fp.header = external_header
     fp.generate_decoder()
 
     assert True
@@ -1,14 +1,15 @@
 import pytest
 import pytest_benchmark
 import struct
+import sys
 import rawutil
-from animal_tag.serializer.utils import import_external_header
+import numpy as np
+from animal_tag.serializer.utils import unwrapper, get_packet_dtype, get_packet_unpacker, correct_format
+from array import array
 from collections import deque
+from functools import lru_cache
 from itertools import starmap, repeat
 
-from pathlib import Path
-
-THIS_DIR = Path(__file__).parent
 
 def test_simple_parser():
     test_bytes = b'\x01\x02'
@@ -30,12 +31,20 @@ def test_simple_serialize_padded():
     vals = struct.pack("<Bx", 1)
     assert vals == b'\x01\x00'
 
+@lru_cache(maxsize=None)
+def compiled_struct(parsing):
+    return struct.Struct(parsing)
+
 def struct_unpack(parsing, test_bytes):
-    vals = struct.unpack(parsing, test_bytes)
+    vals = compiled_struct(parsing).unpack_from(test_bytes)  # the format is compiled once, like a decoder would
     return vals
 
+@lru_cache(maxsize=None)
+def compiled_rawutil(parsing):
+    return rawutil.Struct(parsing)
+
 def rawutils_unpack(parsing, test_bytes):
-    vals = rawutil.unpack(parsing, test_bytes)
+    vals = compiled_rawutil(parsing).unpack(test_bytes)  # compiled once, so both benchmarks only time unpacking
     return vals
 
 def test_simple_struct_benchmark(benchmark):    # given the benchmark results, we really want to use struct over rawutils.
@@ -45,6 +54,36 @@ def test_simple_struct_benchmark(benchmark):    # given the benchmark results, w
     vals = benchmark(struct_unpack, parsing, test_bytes)
     assert list(vals) == orig_vals
 
+def test_simple_struct_benchmark_memview(benchmark):  # unpack_from reads any buffer, without copying it to bytes
+    parsing = "<"+2048*"H"
+    orig_vals = [1995 for _ in range(2048)]
+    test_bytes = struct.pack(parsing, *orig_vals)
+    vals = benchmark(struct_unpack, parsing, memoryview(test_bytes))
+    assert vals == struct_unpack(parsing, test_bytes)
+    assert list(vals) == orig_vals
+
+def array_unpack(test_bytes):
+    vals = array("H")
+    vals.frombytes(test_bytes)  # a bulk copy in native byte order, with no ints made until the values are read
+    if sys.byteorder == "big":
+        vals.byteswap()
+    return vals
+
+def test_simple_array_benchmark(benchmark):  # the same bulk copy as numpy, without needing numpy
+    parsing = "<"+2048*"H"
+    orig_vals = [1995 for _ in range(2048)]
+    test_bytes = struct.pack(parsing, *orig_vals)
+    vals = benchmark(array_unpack, test_bytes)
+    assert list(vals) == orig_vals
+
+def test_simple_frombuffer_benchmark(benchmark):  # the floor for fixed-width packets, and what the deserializer uses
+    parsing = "<"+2048*"H"
+    orig_vals = [1995 for _ in range(2048)]
+    test_bytes = struct.pack(parsing, *orig_vals)
+    vals = benchmark(np.frombuffer, test_bytes, dtype="<u2")
+    assert np.array_equal(vals, orig_vals)
+
+@pytest.mark.slow
 def test_simple_rawutils_benchmark(benchmark):
     parsing = "<"+2048*"H"
     orig_vals = [1995 for _ in range(2048)]
@@ -52,11 +91,8 @@ def test_simple_rawutils_benchmark(benchmark):
     vals = benchmark(rawutils_unpack, parsing, test_bytes)
     assert vals == orig_vals
 
-def test_external_header():
-    file_path = THIS_DIR / "Data/test_header.txt"
-    header = import_external_header(file_path)
-
-    assert len(header.keys()) == 2
+def test_external_header(external_header):
+    assert len(external_header.keys()) == 2
 
 def test_deque_extension():
     dq_len = 10
@@ -65,4 +101,34 @@ def test_deque_extension():
 
     array.extend(starmap(dq.popleft, repeat((), dq_len)))
     assert len(array) == dq_len
-    assert len(dq) == 0
\ No newline at end of file
+    assert len(dq) == 0
+
+@pytest.mark.parametrize("values, expected, num_overflows", [([1, 2, 3], [1, 2, 3], 0),
+                                                            ([254, 255, 0, 1], [254, 255, 256, 257], 1),
+                                                            ([254, 0, 255], [254, 256, 255], 1),
+                                                            ([253, 0, 254, 255, 1], [253, 256, 254, 255, 257], 1),
+                                                            ([250, 5, 130, 250, 5], [250, 261, 386, 506, 517], 2)])
+def test_unwrapper(values, expected, num_overflows):
+    items, overflows = unwrapper(values, max_number=256, bad_frac=0.5)
+    assert items.tolist() == expected
+    assert overflows == num_overflows
+
+def test_unwrapper_open_run():
+    # the out of order run at 254 has no overflow after it, and the only overflow (253 to 0) closes the run at 253
+    with pytest.raises(ValueError):
+        unwrapper([100, 253, 0, 254], max_number=256, bad_frac=0.5)
+
+
+@pytest.mark.parametrize("format, packets", [("uTU", [(-(2**23), 0, 2**24 - 1), (-1, 2**32 - 1, 5)]),
+                                             ("HuxU", [(2**16 - 1, 2**23 - 1, 0), (3, -5, 2**23)]),
+                                             ("Bh", [(255, -(2**15)), (0, 2**15 - 1)])])
+def test_packet_unpacker(format, packets):
+    buffer = rawutil.pack("<" + correct_format(format) * len(packets), *[v for packet in packets for v in packet])
+    data, time = get_packet_unpacker(format)(np.frombuffer(buffer, dtype=get_packet_dtype(format)))
+
+    channels = [list(channel) for channel in zip(*packets)]
+    if "T" in format:
+        assert list(time) == channels.pop(format.index("T"))
+    else:
+        assert time == []
+    assert [list(channel) for channel in data] == channels
@@ -1,25 +1,142 @@
 from collections import deque
-from itertools import starmap, repeat
+from itertools import starmap, repeat, islice
 from collections.abc import Iterable
 from typing import Any
 
 import pytest
+import numpy as np
 
+from animal_tag.serializer.utils import DataBuffer, drop, MAX_TIME, MICROSECONDS_IN_A_SECOND
 
-def pop_enumerate(n : int) -> Iterable[Any]:
-    x = deque([i for i in range(2560)])
+
+def pop_enumerate(x : deque, n : int) -> Iterable[Any]:
     return [x.popleft() for _ in range(n)]
 
-def pop_starmap(n : int) -> Iterable[Any]:
-    x = deque([i for i in range(2560)])
+def pop_starmap(x : deque, n : int) -> Iterable[Any]:
     return list(starmap(x.popleft, repeat((), n)))
 
+def pop_islice(x : deque, n : int) -> Iterable[Any]:
+    head = list(islice(x, n))
+    rest = list(islice(x, n, None))  # the rest is copied over in C, rather than popping the head off one by one
+    x.clear()
+    x.extend(rest)
+    return head
+
+def pop_slice(x : list, n : int) -> Iterable[Any]:
+    head, x[:n] = x[:n], []  # one bulk slice and delete rather than n popleft calls
+    return head
+
+def pop_memview(x : memoryview, n : int) -> Iterable[Any]:
+    return x[:n], x[n:]  # the head and the rest are both views, so popping moves a pointer rather than the data
+
+def benchmark_pop(benchmark, pop, make, n):
+    """Benchmark popping n elements off a fresh container, leaving building the container out of the timing"""
+    return benchmark.pedantic(pop, setup=lambda: ((make(), n), {}), rounds=200, iterations=1)
+
 @pytest.mark.parametrize("n", [1, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048])
 def test_deque_popleft_array_func(n, benchmark):
-    vals = benchmark(pop_enumerate, n)
+    vals = benchmark_pop(benchmark, pop_enumerate, lambda: deque(range(2560)), n)
     assert len(vals) == n
 
 @pytest.mark.parametrize("n", [1, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048])
 def test_deque_starmap_pop(n, benchmark):
-    vals = benchmark(pop_starmap, n)
-    assert len(vals) == n
\ No newline at end of file
+    vals = benchmark_pop(benchmark, pop_starmap, lambda: deque(range(2560)), n)
+    assert len(vals) == n
+
+@pytest.mark.parametrize("n", [1, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048])
+def test_deque_islice_pop(n, benchmark):
+    vals = benchmark_pop(benchmark, pop_islice, lambda: deque(range(2560)), n)
+    assert vals == list(range(n))
+
+@pytest.mark.parametrize("n", [1, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048])
+def test_list_slice_pop(n, benchmark):
+    vals = benchmark_pop(benchmark, pop_slice, lambda: list(range(2560)), n)
+    assert vals == list(range(n))
+
+@pytest.mark.parametrize("n", [1, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048])
+def test_memview_head_pop(n, benchmark):
+    vals, rest = benchmark_pop(benchmark, pop_memview, lambda: memoryview(bytes(range(256))*10), n)
+    assert vals.tolist() == [i % 256 for i in range(n)]
+    assert len(rest) == 2560 - n
+
+def test_data_buffer_pop_order():
+    buffer = DataBuffer(pop_boundry=4, chunk_size=3, channel_types=(np.uint16, np.int8))
+    buffer.reset()
+    samples = np.arange(3*10)
+    popped = []
+    for i in range(10):
+        chunk = samples[3*i:3*(i+1)]
+        buffer.append_raw_data((), 3*(i+1), [chunk, -chunk], [])
+        if i % 4 == 3:  # pop part of what was added, so data has to be moved around for the next extend
+            popped.append(buffer.pop_data(3, 3, 2).data)
+    popped.append(buffer.pop_data(buffer.num_buffers, 3, 2).data)
+
+    data = np.concatenate(popped)
+    assert data.dtype == np.int32  # smallest type holding both uint16 and int8
+    assert np.array_equal(data[:, 0], samples)
+    assert np.array_equal(data[:, 1], -samples)
+
+
+def test_data_buffer_pop_split_channels():
+    buffer = DataBuffer(pop_boundry=4, chunk_size=3, channel_types=(np.uint16, np.int8), split_channels=True)
+    buffer.reset()
+    samples = np.arange(3*4)
+    for i in range(4):
+        chunk = samples[3*i:3*(i+1)]
+        buffer.append_raw_data((), 3*(i+1), [chunk, -chunk], [])
+    unsigned, signed = buffer.pop_data(4, 3, 2).data
+
+    assert unsigned.dtype == np.uint16 and signed.dtype == np.int8  # each channel keeps its own type
+    assert np.array_equal(unsigned, samples)
+    assert np.array_equal(signed, -samples)
+
+
+def test_data_buffer_header_time_interpolation():
+    buffer = DataBuffer(pop_boundry=2, chunk_size=4, channel_types=(np.uint16, ))
+    buffer.reset()
+    header_times = [MAX_TIME - 4008, MAX_TIME - 8, 3992, 7992]  # the tag's clock wraps after the second buffer
+    buffer.last_time = MAX_TIME - 8008  # time of the buffer before the first one here
+    popped = []
+    for header_time in header_times:
+        if buffer.append_raw_data((), header_time, [np.zeros(4)], []):
+            popped.append(buffer.pop_data(2, 4, 1).time)
+
+    time = np.concatenate(popped)*MICROSECONDS_IN_A_SECOND
+    assert len(time) == 16
+    assert np.allclose(np.diff(time), 1000)
+
+
+def test_data_buffer_header_time_wrap_within_pop():
+    buffer = DataBuffer(pop_boundry=2, chunk_size=4, channel_types=(np.uint16, ))
+    buffer.reset()
+    # the tag's clock wraps between the first two buffers, so within the first pop
+    header_times = [(MAX_TIME - 8 + 4000*i) % MAX_TIME for i in range(1, 5)]
+    buffer.last_time = MAX_TIME - 8
+    popped = []
+    for header_time in header_times:
+        if buffer.append_raw_data((), header_time, [np.zeros(4)], []):
+            popped.append(buffer.pop_data(2, 4, 1).time)
+
+    time = np.concatenate(popped)*MICROSECONDS_IN_A_SECOND
+    assert np.allclose(np.diff(time), 1000)
+
+
+def test_data_buffer_time_unwrap():
+    buffer = DataBuffer(pop_boundry=2, chunk_size=4, channel_types=(np.uint16, ), has_time=True)
+    buffer.reset()
+    times = (MAX_TIME - 5000 + 1000*np.arange(1, 17)) % MAX_TIME  # the tag's clock wraps in the second buffer
+    popped = []
+    for i in range(4):
+        if buffer.append_raw_data((), 4*(i+1), [np.zeros(4)], times[4*i:4*(i+1)]):
+            popped.append(buffer.pop_data(2, 4, 1).time)
+
+    time = np.concatenate(popped)*MICROSECONDS_IN_A_SECOND
+    assert len(time) == 16
+    assert np.allclose(np.diff(time), 1000)
+
+
+@pytest.mark.parametrize("n", [0, 3, 10])
+def test_drop(n):
+    x = deque(range(10))
+    drop(x, n)
+    assert list(x) == list(range(n, 10))